@@ -77,6 +77,42 @@ else:
         }
     }
 
+CACHES = {
+    # Файловый кеш общий для всех процессов на сервере (воркеры gunicorn,
+    # manage.py).
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': config(
+            'CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    },
+    # Версии данных из recipes.cache, прочитанные процессом из базы.
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'versions',
+    },
+    # Сериализованные рецепты, общие для всех пользователей.
+    'fragments': {
+        'BACKEND': 'recipes.cache_backends.SizeLimitedLocMemCache',
+        'LOCATION': 'fragments',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': config(
+                'FRAGMENT_CACHE_MAX_ENTRIES', default=20000, cast=int
+            ),
+            'MAX_SIZE': config(
+                'FRAGMENT_CACHE_MAX_SIZE', default=32 * 1024 * 1024, cast=int
+            ),
+        },
+    },
+}
+
 AUTH_USER_MODEL = 'users.User'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -114,6 +150,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Файлы крупнее порога пишутся обработчиком загрузки во временный файл,
+# а не держатся в памяти процесса.
+FILE_UPLOAD_MAX_MEMORY_SIZE = config(
+    'FILE_UPLOAD_MAX_MEMORY_SIZE', default=2621440, cast=int
+)
+
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
 
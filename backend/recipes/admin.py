@@ -1,7 +1,69 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import SEARCH_VAR
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Prefetch, Q
+from django.utils.functional import cached_property
 
+from .cache import bump_version
 from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingCartIngredient, Tag)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, который для полной таблицы на PostgreSQL не считает строки.
+
+    Вместо COUNT(*) берется оценка из статистики планировщика (pg_class),
+    для отфильтрованных списков число строк считается как обычно.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > 0:
+                return int(row[0])
+        return super().count
+
+
+class AuthorFilter(admin.SimpleListFilter):
+    """Фильтр по автору с полем ввода вместо списка всех пользователей."""
+    title = 'автор'
+    parameter_name = 'author'
+    template = 'admin/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        query_parts = [
+            (key, value)
+            for key, value in changelist.get_filters_params().items()
+            if key != self.parameter_name
+        ]
+        if changelist.query:
+            query_parts.append((SEARCH_VAR, changelist.query))
+        yield {'query_parts': query_parts}
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        if value.isdigit():
+            return queryset.filter(author_id=value)
+        return queryset.filter(
+            Q(author__username=value) | Q(author__email=value)
+        )
 
 
 @admin.register(Tag)
@@ -21,6 +83,7 @@ class IngredientAdmin(admin.ModelAdmin):
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
+    autocomplete_fields = ('ingredient', )
     min_num = 1
     extra = 0
 
@@ -37,12 +100,48 @@ class RecipeAdmin(admin.ModelAdmin):
         'list_tags', 'count_favorites'
     )
     list_display_links = ('name', )
-    list_filter = ('author', )
+    list_filter = (AuthorFilter, )
+    list_select_related = ('author', )
     search_fields = (
         'name', 'author__username', 'ingredients__name', 'tags__name'
     )
+    autocomplete_fields = ('author', )
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
     inlines = [RecipeIngredientInline, ]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredients',
+                RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        """Ищет по ингредиентам и тегам подзапросами, без JOIN и DISTINCT."""
+        for term in search_term.split():
+            queryset = queryset.filter(
+                Q(name__icontains=term)
+                | Q(author__username__icontains=term)
+                | Q(pk__in=RecipeIngredient.objects.filter(
+                    ingredient__name__icontains=term
+                ).values('recipe'))
+                | Q(pk__in=Recipe.tags.through.objects.filter(
+                    tag__name__icontains=term
+                ).values('recipe'))
+            )
+        return queryset, False
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        user_ids = list(ShoppingCart.objects.filter(
+            recipe=form.instance
+        ).values_list('user_id', flat=True))
+        ShoppingCartIngredient.objects.rebuild(user_ids)
+        bump_version(*(f'cart:{user_id}' for user_id in user_ids))
+
     def list_ingredients(self, obj):
         return ', '.join(i.ingredient.name for i in obj.ingredients.all())
     list_ingredients.short_description = 'ингредиенты'
@@ -52,8 +151,9 @@ class RecipeAdmin(admin.ModelAdmin):
     list_tags.short_description = 'теги'
 
     def count_favorites(self, obj):
-        return obj.favorited.count()
+        return obj.favorites_count
     count_favorites.short_description = 'в избранном'
+    count_favorites.admin_order_field = 'favorites_count'
 
 
 @admin.register(Favorite)
@@ -0,0 +1,61 @@
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+
+from .db import insert_or_ignore
+
+VERSION_KEY = 'version:{}'
+# Страховка для изменений, прошедших мимо сигналов (update(), raw SQL).
+DATA_CACHE_TIMEOUT = 60 * 10
+# Сколько процесс помнит прочитанную из базы версию; изменения из других
+# процессов видны не позже, чем через это время.
+VERSION_CACHE_TIMEOUT = 1
+
+
+def get_versions(*names):
+    """Текущие версии наборов данных names, не более одного запроса."""
+    from .models import DataVersion
+
+    keys = {name: VERSION_KEY.format(name) for name in names}
+    cached = caches['versions'].get_many(keys.values())
+    missing = [name for name in names if keys[name] not in cached]
+    if missing:
+        loaded = dict(DataVersion.objects.filter(
+            name__in=missing
+        ).values_list('name', 'value'))
+        loaded = {keys[name]: loaded.get(name, 0) for name in missing}
+        caches['versions'].set_many(loaded, VERSION_CACHE_TIMEOUT)
+        cached.update(loaded)
+    return [cached[keys[name]] for name in names]
+
+
+def get_version(name):
+    """Текущая версия набора данных name для построения ключей кеша."""
+    return get_versions(name)[0]
+
+
+def _incr_versions(names):
+    from .models import DataVersion
+
+    # Сначала создаются недостающие строки, затем все версии увеличиваются
+    # одним UPDATE, поэтому параллельное первое изменение не теряется.
+    insert_or_ignore(
+        DataVersion, [{'name': name, 'value': 0} for name in names], 'name'
+    )
+    DataVersion.objects.filter(name__in=names).update(value=F('value') + 1)
+    caches['versions'].delete_many(
+        [VERSION_KEY.format(name) for name in names]
+    )
+
+
+def bump_version(*names):
+    """Меняет версии наборов данных, делая их прежние записи недоступными.
+
+    Версии увеличиваются одним UPDATE в базе, поэтому параллельные
+    изменения не теряются, а версия никогда не повторяется. Это
+    происходит после фиксации текущей транзакции, чтобы параллельный
+    запрос не успел закешировать старые данные под новой версией.
+    """
+    names = list(dict.fromkeys(names))
+    if names:
+        transaction.on_commit(lambda: _incr_versions(names))
@@ -0,0 +1,56 @@
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+_sizes = {}
+
+
+class SizeLimitedLocMemCache(LocMemCache):
+    """LocMemCache с ограничением суммарного размера значений.
+
+    Кроме MAX_ENTRIES в OPTIONS задается MAX_SIZE в байтах; при
+    превышении вытесняются записи, которые дольше всех не читались.
+    Размер считается по сериализованным pickle значениям.
+    """
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        options = params.get('OPTIONS', {})
+        self._max_size = int(options.get('MAX_SIZE', 16 * 1024 * 1024))
+        self._name = name
+        _sizes.setdefault(name, 0)
+
+    def _pop_least_recent(self):
+        self._delete(next(reversed(self._cache)))
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._delete(key)
+        if len(value) > self._max_size:
+            return
+        while self._cache and (
+            _sizes[self._name] + len(value) > self._max_size
+            or len(self._cache) >= self._max_entries
+        ):
+            self._pop_least_recent()
+        super()._set(key, value, timeout)
+        _sizes[self._name] += len(value)
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            count = len(self._cache)
+        else:
+            count = len(self._cache) // self._cull_frequency
+        for _ in range(count):
+            self._pop_least_recent()
+
+    def _delete(self, key):
+        value = self._cache.get(key)
+        if not super()._delete(key):
+            return False
+        _sizes[self._name] -= len(value)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expire_info.clear()
+            _sizes[self._name] = 0
@@ -0,0 +1,113 @@
+from django.db import IntegrityError, connections, router, transaction
+
+
+def supports_on_conflict_returning(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    return (
+        connection.vendor == 'sqlite'
+        and connection.Database.sqlite_version_info >= (3, 35)
+    )
+
+
+def insert_or_ignore(model, rows, returning):
+    """Вставляет строки rows, пропуская уже существующие, одним запросом.
+
+    rows - список словарей {attname поля: значение}. Возвращает значения
+    поля returning только у действительно вставленных строк, поэтому
+    повторная вставка безопасна и при параллельных запросах. На базах без
+    INSERT ... ON CONFLICT ... RETURNING строки вставляются по одной.
+    """
+    if not rows:
+        return []
+    using = router.db_for_write(model)
+    connection = connections[using]
+    if not supports_on_conflict_returning(connection):
+        inserted = []
+        for row in rows:
+            try:
+                with transaction.atomic(using=using):
+                    model.objects.using(using).bulk_create([model(**row)])
+            except IntegrityError:
+                continue
+            inserted.append(row[returning])
+        return inserted
+    quote = connection.ops.quote_name
+    columns = [model._meta.get_field(name).column for name in rows[0]]
+    placeholders = '({})'.format(', '.join(['%s'] * len(columns)))
+    sql = (
+        'INSERT INTO {table} ({columns}) VALUES {values} '
+        'ON CONFLICT DO NOTHING RETURNING {returning}'
+    ).format(
+        table=quote(model._meta.db_table),
+        columns=', '.join(quote(column) for column in columns),
+        values=', '.join([placeholders] * len(rows)),
+        returning=quote(model._meta.get_field(returning).column),
+    )
+    params = [value for row in rows for value in row.values()]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def delete_returning(queryset, returning):
+    """Удаляет строки queryset и возвращает поле returning удаленных строк.
+
+    Возвращаются только строки, удаленные именно этим запросом, поэтому при
+    параллельном удалении одной строки она попадает в результат один раз.
+    На базах без DELETE ... RETURNING строки блокируются select_for_update
+    внутри транзакции. Сигналы удаления не отправляются.
+    """
+    using = queryset.db
+    connection = connections[using]
+    model = queryset.model
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    pk = quote(model._meta.pk.column)
+    if not supports_on_conflict_returning(connection):
+        with transaction.atomic(using=using):
+            rows = dict(
+                queryset.select_for_update().values_list('pk', returning)
+            )
+            if rows:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'DELETE FROM {} WHERE {} IN ({})'.format(
+                            table, pk, ', '.join(['%s'] * len(rows))
+                        ),
+                        list(rows)
+                    )
+            return list(rows.values())
+    subquery, params = queryset.values('pk').query.sql_with_params()
+    sql = (
+        'DELETE FROM {table} WHERE {pk} IN ({subquery}) '
+        'RETURNING {returning}'
+    ).format(
+        table=table,
+        pk=pk,
+        subquery=subquery,
+        returning=quote(model._meta.get_field(returning).column),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+class CounterFieldsMixin:
+    """Не перезаписывает счетчики counter_fields при полном save().
+
+    Счетчики меняются только выражениями F() в update(), поэтому значение,
+    загруженное вместе с объектом, может быть устаревшим. Сохранение уже
+    существующего объекта без update_fields пишет все поля, кроме
+    счетчиков; явно названные в update_fields счетчики сохраняются.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
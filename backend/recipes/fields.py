@@ -0,0 +1,90 @@
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework import serializers
+
+from .images import variant_name, variants_ready
+
+
+def resolve_pks(queryset, pks):
+    """Загружает объекты по списку pk одним запросом IN.
+
+    Возвращает объекты в порядке pks и список pk, которых нет в queryset.
+    """
+    found = queryset.in_bulk(set(pks))
+    missing = [pk for pk in dict.fromkeys(pks) if pk not in found]
+    return [found[pk] for pk in pks if pk in found], missing
+
+
+class BulkPrimaryKeyRelatedField(serializers.ListField):
+    """Список первичных ключей, разрешаемый одним запросом к базе.
+
+    В отличие от PrimaryKeyRelatedField(many=True), не делает отдельный
+    запрос на каждый pk и сообщает сразу обо всех несуществующих.
+    """
+    default_error_messages = {
+        'does_not_exist': 'Объекты с id {pk_values} не существуют.',
+        'duplicates': 'Значения не должны повторяться: {pk_values}.',
+    }
+
+    def __init__(self, queryset, **kwargs):
+        self.queryset = queryset
+        kwargs.setdefault('child', serializers.IntegerField(min_value=1))
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        pks = super().to_internal_value(data)
+        if len(set(pks)) != len(pks):
+            seen = set()
+            duplicates = {pk for pk in pks if pk in seen or seen.add(pk)}
+            self.fail(
+                'duplicates',
+                pk_values=', '.join(str(pk) for pk in sorted(duplicates))
+            )
+        objects, missing = resolve_pks(self.queryset.all(), pks)
+        if missing:
+            self.fail(
+                'does_not_exist',
+                pk_values=', '.join(str(pk) for pk in missing)
+            )
+        return objects
+
+    def to_representation(self, value):
+        return [item.pk for item in value.all()]
+
+
+class ImageVariantField(serializers.ImageField):
+    """Ссылка на уменьшенную копию изображения, если она уже готова.
+
+    Пока копии не созданы фоновой задачей, отдается ссылка на оригинал.
+    """
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        if not variants_ready(value.name, value.storage):
+            return super().to_representation(value)
+        name = variant_name(value.name, self.variant)
+        url = value.storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class UploadableImageField(Base64ImageField):
+    """Изображение строкой base64 в JSON или файлом в multipart/form-data.
+
+    Файл из multipart уже сохранен обработчиками загрузки Django (крупные
+    во временный файл на диске), поэтому он не декодируется повторно и
+    проверяется как обычный ImageField.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return serializers.ImageField.to_internal_value(self, data)
+        return super().to_internal_value(data)
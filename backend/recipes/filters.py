@@ -1,18 +1,108 @@
+from django.core.cache import cache
 import django_filters as filters
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import BaseFilterBackend
 
-from .models import Recipe
+from .cache import DATA_CACHE_TIMEOUT, get_version
+from .models import Favorite, Recipe, ShoppingCart, Tag
+from .search import ingredient_index
 
 
-class IngredientFilter(SearchFilter):
+def get_tag_ids_by_slug():
+    """Словарь slug -> id всех тегов из кеша с версией 'tags'."""
+    key = 'tag_ids_by_slug:{}'.format(get_version('tags'))
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, DATA_CACHE_TIMEOUT)
+    return tag_ids
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_ids_by_slug()]
+
+
+class IngredientFilter(BaseFilterBackend):
+    """Поиск ингредиентов по началу и вхождению в название.
+
+    Выдача берется из индекса в памяти процесса, без запроса к базе.
+    С параметром fuzzy=1 поиск учитывает опечатки и возвращает limit
+    ближайших по написанию ингредиентов.
+    """
     search_param = 'name'
+    fuzzy_param = 'fuzzy'
+    limit_param = 'limit'
+    fuzzy_limit = 10
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_param])
+        except (KeyError, ValueError):
+            return self.fuzzy_limit
+        return max(limit, 1)
+
+    def filter_queryset(self, request, queryset, view):
+        name = request.query_params.get(self.search_param)
+        if not name or view.action != 'list':
+            return queryset
+        if request.query_params.get(self.fuzzy_param) == '1':
+            return ingredient_index.fuzzy_search(
+                name, self.get_limit(request)
+            )
+        return ingredient_index.search(name)
+
+
+class TagsFilter(filters.MultipleChoiceFilter):
+    """Рецепты хотя бы с одним из тегов по их slug.
+
+    Slug проверяются по словарю тегов из кеша, а рецепты выбираются
+    подзапросом IN по связующей таблице по индексу (tag_id, recipe_id),
+    без JOIN, поэтому рецепты не дублируются и DISTINCT не нужен.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('choices', tag_choices)
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        tag_ids = get_tag_ids_by_slug()
+        return qs.filter(pk__in=Recipe.tags.through.objects.filter(
+            tag_id__in=[tag_ids[slug] for slug in value if slug in tag_ids]
+        ).values('recipe_id'))
+
+
+class UserRecipesFilter(filters.NumberFilter):
+    """Рецепты, которые есть (1) или которых нет (0) в списке пользователя.
+
+    Отбор начинается со строк пользователя в model: recipe_id IN (SELECT
+    recipe_id ... WHERE user_id = ?) по уникальному индексу (user, recipe),
+    поэтому время зависит от размера списка, а не от числа рецептов.
+    """
+
+    def __init__(self, model, *args, **kwargs):
+        self.list_model = model
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value is None:
+            return qs
+        user = self.parent.request.user
+        if not user.is_authenticated:
+            return qs.none() if value else qs
+        recipe_ids = self.list_model.objects.filter(
+            user=user
+        ).order_by().values('recipe_id')
+        if value:
+            return qs.filter(pk__in=recipe_ids)
+        return qs.exclude(pk__in=recipe_ids)
 
 
 class RecipeFilter(filters.FilterSet):
     author = filters.NumberFilter(field_name='author__id')
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
-    is_favorited = filters.NumberFilter()
-    is_in_shopping_cart = filters.NumberFilter()
+    tags = TagsFilter()
+    is_favorited = UserRecipesFilter(Favorite)
+    is_in_shopping_cart = UserRecipesFilter(ShoppingCart)
 
     class Meta:
         model = Recipe
@@ -0,0 +1,123 @@
+import io
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .storage import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Только копии, которые отдают сериализаторы (ImageVariantField).
+VARIANTS = {
+    'thumb': (240, 240),
+}
+FORMATS = {
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='images')
+# Изображения, копии которых уже есть, и изображения в очереди пула.
+_ready = set()
+_scheduled = set()
+_lock = threading.Lock()
+
+
+def variant_name(name, variant, extension='jpg'):
+    """Имя файла уменьшенной копии: recipes/variants/<имя>_<variant>.jpg."""
+    directory, filename = posixpath.split(posixpath.splitext(name)[0])
+    return posixpath.join(
+        directory, 'variants', f'{filename}_{variant}.{extension}'
+    )
+
+
+def variant_names(name):
+    return {
+        (variant, extension): variant_name(name, variant, extension)
+        for variant in VARIANTS
+        for extension in FORMATS
+    }
+
+
+def variants_ready(name, storage=default_storage):
+    """Созданы ли все копии изображения.
+
+    Готовность запоминается в процессе, поэтому файлы проверяются только
+    до первого положительного ответа.
+    """
+    if name in _ready:
+        return True
+    if all(storage.exists(target) for target in variant_names(name).values()):
+        _ready.add(name)
+        return True
+    return False
+
+
+def save_exact(storage, name, data):
+    """Сохраняет файл ровно под именем name, заменяя существующий."""
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        if not storage.exists(name):
+            storage.save(name, ContentFile(data))
+        return
+    write_atomic(path, [data], storage.file_permissions_mode)
+
+
+def make_variants(name, storage=default_storage):
+    """Сохраняет уменьшенные копии изображения VARIANTS в форматах FORMATS."""
+    targets = variant_names(name)
+    targets = {
+        key: target for key, target in targets.items()
+        if not storage.exists(target)
+    }
+    if not targets:
+        _ready.add(name)
+        return
+    with storage.open(name) as file:
+        image = Image.open(file)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    for variant, size in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        for extension, (image_format, options) in FORMATS.items():
+            target = targets.get((variant, extension))
+            if target is None:
+                continue
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format, **options)
+            save_exact(storage, target, buffer.getvalue())
+    _ready.add(name)
+
+
+def _make_variants(name):
+    try:
+        make_variants(name)
+    except FileNotFoundError:
+        logger.warning('Нет файла изображения %s', name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+    finally:
+        with _lock:
+            _scheduled.discard(name)
+
+
+def _submit(name):
+    with _lock:
+        if name in _ready or name in _scheduled:
+            return
+        _scheduled.add(name)
+    executor.submit(_make_variants, name)
+
+
+def schedule_variants(name):
+    """Ставит обработку изображения в фоновый пул после фиксации транзакции.
+
+    Изображение, которое уже в очереди или обработано, повторно не ставится.
+    """
+    transaction.on_commit(lambda: _submit(name))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import make_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные копии изображений уже сохраненных рецептов.'
+
+    def handle(self, *args, **options):
+        names = Recipe.objects.exclude(image='').values_list(
+            'image', flat=True
+        )
+        for name in names.iterator():
+            try:
+                make_variants(name)
+            except OSError as error:
+                self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,38 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCartIngredient
+
+User = get_user_model()
+
+
+def count_of(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(count=Count('pk')).values('count')
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики favorites_count у рецептов, '
+            'recipes_count у пользователей и суммы в списках покупок.')
+
+    def handle(self, *args, **options):
+        favorites_count = count_of(Favorite.objects.all(), 'recipe')
+        recipes = Recipe.objects.exclude(
+            favorites_count=favorites_count
+        ).update(favorites_count=favorites_count)
+        recipes_count = count_of(Recipe.objects.all(), 'author')
+        users = User.objects.exclude(
+            recipes_count=recipes_count
+        ).update(recipes_count=recipes_count)
+        ShoppingCartIngredient.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено рецептов: {recipes}, пользователей: {users}'
+        ))
@@ -1,55 +1,152 @@
-from django.contrib.auth import get_user_model
-from django.db.models import Count, Exists, OuterRef, Prefetch, QuerySet, Value
+from django.db import transaction
+from django.db.models import Case, F, Prefetch, QuerySet, Sum, Value, When
+from django.utils import timezone
 
-from users.models import Follow
 from . import models
-
-User = get_user_model()
+from .db import delete_returning, insert_or_ignore
 
 
 class RecipeQuerySet(QuerySet):
 
-    def annotated(self, user):
-        if not user.is_authenticated:
-            return self.annotate(
-                is_favorited=Value(0),
-                is_in_shopping_cart=Value(0)
-            )
-        return self.annotate(
-            is_favorited=Exists(
-                models.Favorite.objects.filter(
-                    recipe=OuterRef('pk'),
-                    user=user
-                )
-            ),
-            is_in_shopping_cart=Exists(
-                models.ShoppingCart.objects.filter(
-                    recipe=OuterRef('pk'),
-                    user=user
-                )
+    def touch(self):
+        """Обновляет updated_at, по которому считаются ETag рецептов."""
+        return self.update(updated_at=timezone.now())
+
+    def user_flags(self, user, recipe_ids):
+        """Флаги is_favorited и is_in_shopping_cart для рецептов recipe_ids.
+
+        Два запроса с IN по id рецептов страницы вместо подзапросов Exists
+        в каждой строке, поэтому сам запрос рецептов не зависит от
+        пользователя.
+        """
+        if not user.is_authenticated or not recipe_ids:
+            return {pk: (False, False) for pk in recipe_ids}
+        favorited, in_shopping_cart = (
+            set(
+                model.objects.filter(
+                    user=user, recipe_id__in=recipe_ids
+                ).order_by().values_list('recipe_id', flat=True)
             )
+            for model in (models.Favorite, models.ShoppingCart)
         )
+        return {
+            pk: (pk in favorited, pk in in_shopping_cart)
+            for pk in recipe_ids
+        }
 
-    def prefetched(self, user):
-        if not user.is_authenticated:
-            return self.prefetch_related(
-                Prefetch(
-                    'author',
-                    User.objects.annotate(
-                        is_subscribed=Count(0)
-                    )
-                )
-            )
-        return self.prefetch_related(
+    def prefetch_lookups(self):
+        """Связанные объекты для RecipeDisplaySerializer.
+
+        Теги, ингредиенты вместе с Ingredient и авторы загружаются
+        отдельными запросами на все рецепты сразу и не зависят от
+        пользователя: его флаги проставляются поверх из get_recipe_flags.
+        """
+        return (
+            'tags',
             Prefetch(
-                'author',
-                User.objects.annotate(
-                    is_subscribed=Exists(
-                        Follow.objects.filter(
-                            follower=user,
-                            following=OuterRef('pk')
-                        )
-                    )
-                )
+                'ingredients',
+                models.RecipeIngredient.objects.select_related('ingredient')
+            ),
+            'author',
+        )
+
+
+class ShoppingCartIngredientQuerySet(QuerySet):
+
+    def apply(self, user_ids, deltas):
+        """Прибавляет deltas {id ингредиента: количество} к спискам покупок.
+
+        Число запросов не зависит ни от числа пользователей, ни от числа
+        ингредиентов; строки с нулевым количеством удаляются.
+        """
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        user_ids = list(user_ids)
+        if not deltas or not user_ids:
+            return
+        self.bulk_create(
+            [
+                self.model(user_id=user_id, ingredient_id=pk, amount=0)
+                for user_id in user_ids
+                for pk, delta in deltas.items() if delta > 0
+            ],
+            ignore_conflicts=True
+        )
+        rows = self.filter(user_id__in=user_ids, ingredient_id__in=deltas)
+        rows.update(amount=F('amount') + Case(
+            *(When(ingredient_id=pk, then=Value(delta))
+              for pk, delta in deltas.items()),
+            default=Value(0)
+        ))
+        rows.filter(amount__lte=0).delete()
+
+    def add_recipes(self, user_id, recipe_ids, sign=1):
+        if not recipe_ids:
+            return
+        self.apply([user_id], {
+            row['ingredient']: sign * row['total']
+            for row in models.RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values('ingredient').order_by().annotate(total=Sum('amount'))
+        })
+
+    def remove_recipes(self, user_id, recipe_ids):
+        self.add_recipes(user_id, recipe_ids, sign=-1)
+
+    def rebuild(self, user_ids=None):
+        """Пересчитывает таблицу с нуля для user_ids или для всех."""
+        carts = models.ShoppingCart.objects.all()
+        rows = self.all()
+        if user_ids is not None:
+            carts = carts.filter(user_id__in=user_ids)
+            rows = rows.filter(user_id__in=user_ids)
+        totals = models.RecipeIngredient.objects.filter(
+            recipe__shoppingcart__in=carts
+        ).values(
+            'recipe__shoppingcart__user', 'ingredient'
+        ).order_by().annotate(total=Sum('amount'))
+        rows.delete()
+        self.bulk_create(
+            self.model(
+                user_id=row['recipe__shoppingcart__user'],
+                ingredient_id=row['ingredient'],
+                amount=row['total']
             )
+            for row in totals.iterator()
+        )
+
+
+class UserRecipeQuerySet(QuerySet):
+    """Пакетное добавление и удаление рецептов в избранном и списке покупок.
+
+    Модель должна определять recipes_added и recipes_removed, которые
+    обновляют зависящие от нее счетчики для всех рецептов сразу.
+    """
+
+    def add(self, user, recipe_ids):
+        """Добавляет рецепты, которых еще нет, и возвращает их id."""
+        new = insert_or_ignore(
+            self.model,
+            [
+                {'user_id': user.pk, 'recipe_id': pk}
+                for pk in dict.fromkeys(recipe_ids)
+            ],
+            'recipe_id'
         )
+        if new:
+            self.model.recipes_added(user.pk, new)
+        return new
+
+    def remove(self, user, recipe_ids):
+        """Удаляет рецепты одним запросом и возвращает id удаленных.
+
+        Счетчики обновляются только для строк, удаленных этим запросом,
+        поэтому параллельное удаление не уменьшает их дважды.
+        """
+        with transaction.atomic(using=self.db):
+            removed = delete_returning(
+                self.filter(user=user, recipe_id__in=recipe_ids).order_by(),
+                'recipe_id'
+            )
+            if removed:
+                self.model.recipes_removed(user.pk, removed)
+        return removed
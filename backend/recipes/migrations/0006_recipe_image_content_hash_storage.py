@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:55
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.storage.ContentHashStorage(), upload_to='recipes', verbose_name='изображение'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_tags_tag_recipe_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='набор данных')),
+                ('value', models.BigIntegerField(default=0, verbose_name='версия')),
+            ],
+            options={
+                'verbose_name': 'версия данных',
+                'verbose_name_plural': 'версии данных',
+            },
+        ),
+    ]
@@ -0,0 +1,219 @@
+import gzip
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, urlencode
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .cache import DATA_CACHE_TIMEOUT, get_version, get_versions
+
+
+class CachedListMixin:
+    """Отдает список объектов из кеша в виде готового JSON.
+
+    Сериализованный список и его сжатая gzip копия хранятся под ключом с
+    версией cache_version_name, которую сигналы меняют при изменении
+    данных, и не дольше DATA_CACHE_TIMEOUT. Ответ содержит ETag, по
+    которому клиент получает 304, если список не изменился. Запросы с
+    параметрами и в других форматах обрабатываются как обычно.
+    """
+    cache_version_name = None
+
+    def get_cached_list(self):
+        key = f'list:{self.cache_version_name}:' + str(
+            get_version(self.cache_version_name)
+        )
+        entry = cache.get(key)
+        if entry is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            serializer = self.get_serializer(queryset, many=True)
+            content = JSONRenderer().render(serializer.data)
+            entry = {
+                'etag': f'"{hashlib.md5(content).hexdigest()}"',
+                'content': content,
+                'gzip': gzip.compress(content),
+            }
+            cache.set(key, entry, DATA_CACHE_TIMEOUT)
+        return entry
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        entry = self.get_cached_list()
+        if entry['etag'] in parse_etags(
+            request.META.get('HTTP_IF_NONE_MATCH', '')
+        ):
+            response = HttpResponseNotModified()
+        elif 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = HttpResponse(
+                entry['gzip'], content_type='application/json'
+            )
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(
+                entry['content'], content_type='application/json'
+            )
+        response['ETag'] = entry['etag']
+        response['Vary'] = 'Accept, Accept-Encoding'
+        return response
+
+
+class ConditionalRetrieveListMixin:
+    """Условные GET для list и retrieve по полю updated_at.
+
+    ETag списка считается по строкам текущей страницы (id и updated_at) и
+    ее навигации, ETag объекта - по его updated_at, вместе с пользователем,
+    полным путем запроса и версиями etag_version_names. Состояние
+    пользователя (избранное, подписки) не меняет updated_at, а входит в
+    ETag версиями etag_user_version_names - шаблонами с id пользователя.
+    При совпадении If-None-Match отдается 304 без сериализации.
+    """
+    etag_version_names = ()
+    etag_user_version_names = ()
+
+    def get_etag_version_names(self):
+        names = list(self.etag_version_names)
+        if self.request.user.is_authenticated:
+            names.extend(
+                name.format(self.request.user.pk)
+                for name in self.etag_user_version_names
+            )
+        return names
+
+    def get_etag(self, *state):
+        parts = [
+            self.request.user.pk,
+            self.request.get_full_path(),
+            self.request.accepted_renderer.format,
+            *state,
+            *get_versions(*self.get_etag_version_names()),
+        ]
+        key = '|'.join(str(part) for part in parts)
+        return f'"{hashlib.md5(key.encode()).hexdigest()}"'
+
+    def conditional_response(self, etag, last_modified, handler, request,
+                             *args, **kwargs):
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        response['Vary'] = 'Accept, Authorization'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+        last_modified = max(
+            (row.updated_at for row in rows if row.updated_at), default=None
+        )
+        state = [
+            [(row.pk, row.updated_at and row.updated_at.isoformat())
+             for row in rows],
+        ]
+        if page is not None:
+            # Навигация (число объектов, ссылки) уже посчитана пагинатором.
+            state.append(self.get_paginated_response([]).data)
+
+        def render(request, *args, **kwargs):
+            serializer = self.get_serializer(rows, many=True)
+            if page is None:
+                return Response(serializer.data)
+            return self.get_paginated_response(serializer.data)
+
+        return self.conditional_response(
+            self.get_etag(*state), last_modified, render, request,
+            *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            last_modified = self.get_queryset().filter(
+                **{self.lookup_field: kwargs[lookup_url_kwarg]}
+            ).values_list('updated_at', flat=True).first()
+        except (TypeError, ValueError):
+            last_modified = None
+        if last_modified is None:
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(
+            self.get_etag(last_modified.isoformat()), last_modified,
+            super().retrieve, request, *args, **kwargs
+        )
+
+
+class AnonymousCacheMixin:
+    """Кеширует ответы list и retrieve для анонимных пользователей.
+
+    Для анонима ответ зависит только от адреса запроса и данных, поэтому
+    он хранится под ключом из схемы, хоста (ответ содержит абсолютные
+    ссылки), отсортированных параметров и версии
+    anonymous_cache_version_name, которую сигналы меняют при изменении
+    данных. Вместе с ответом хранятся его ETag и Last-Modified.
+    """
+    anonymous_cache_version_name = None
+    anonymous_cache_timeout = 60 * 60
+
+    def get_anonymous_cache_key(self, request, kwargs):
+        params = sorted(
+            (name, value)
+            for name in request.query_params
+            for value in request.query_params.getlist(name)
+        )
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        key = '|'.join((
+            request.scheme,
+            request.get_host(),
+            self.action,
+            str(kwargs.get(lookup_url_kwarg, '')),
+            request.accepted_renderer.format,
+            urlencode(params),
+        ))
+        return 'response:{}:{}:{}'.format(
+            self.anonymous_cache_version_name,
+            get_version(self.anonymous_cache_version_name),
+            hashlib.md5(key.encode()).hexdigest()
+        )
+
+    def anonymous_cached(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        key = self.get_anonymous_cache_key(request, kwargs)
+        entry = cache.get(key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, {
+                    'data': response.data,
+                    'headers': {
+                        header: response[header]
+                        for header in ('ETag', 'Last-Modified', 'Vary')
+                        if response.has_header(header)
+                    },
+                }, self.anonymous_cache_timeout)
+            return response
+        headers = entry['headers']
+        if headers.get('ETag') in parse_etags(
+            request.META.get('HTTP_IF_NONE_MATCH', '')
+        ):
+            response = HttpResponseNotModified()
+        else:
+            response = Response(entry['data'])
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.anonymous_cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.anonymous_cached(
+            super().retrieve, request, *args, **kwargs
+        )
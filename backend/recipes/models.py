@@ -3,7 +3,11 @@ from django.core.validators import MinValueValidator
 from django.db import DatabaseError, models, transaction
 from django.utils.translation import gettext as _
 
-from .managers import RecipeQuerySet
+from .cache import bump_version
+from .db import CounterFieldsMixin
+from .managers import (RecipeQuerySet, ShoppingCartIngredientQuerySet,
+                       UserRecipeQuerySet)
+from .storage import ContentHashStorage
 
 User = get_user_model()
 
@@ -53,7 +57,7 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     name = models.CharField(
         verbose_name='название блюда',
         db_index=True,
@@ -67,6 +71,7 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes',
+        storage=ContentHashStorage(),
         verbose_name='изображение'
     )
     text = models.TextField(
@@ -93,8 +98,19 @@ class Recipe(models.Model):
         verbose_name='дата публикации',
         auto_now_add=True,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='дата изменения',
+        auto_now=True,
+        db_index=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='в избранном',
+        default=0,
+        editable=False,
+    )
 
     objects = RecipeQuerySet.as_manager()
+    counter_fields = ('favorites_count', )
 
     def __str__(self):
         return self.name
@@ -103,6 +119,12 @@ class Recipe(models.Model):
         ordering = ['-pub_date']
         verbose_name = _('рецепт')
         verbose_name_plural = _('рецепты')
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            )
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['author', 'name'],
@@ -110,6 +132,18 @@ class Recipe(models.Model):
             )
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Имя изображения из базы, чтобы сигналы видели его замену.
+        if 'image' in field_names:
+            instance.saved_image_name = values[field_names.index('image')]
+        return instance
+
+    @property
+    def image_changed(self):
+        return self.image.name != getattr(self, 'saved_image_name', None)
+
     @staticmethod
     def get_tags_ingredients(**data):
         tags = data.pop('tags')
@@ -118,13 +152,47 @@ class Recipe(models.Model):
 
     @staticmethod
     def add_ingredients(recipe, ingredients):
-        for i in ingredients:
-            RecipeIngredient.objects.create(
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
                 recipe=recipe,
                 ingredient=i['id'],
                 amount=i['amount']
             )
-        return
+            for i in ingredients
+        )
+
+    def set_ingredients(self, ingredients):
+        """Обновляет ингредиенты рецепта, записывая только разницу."""
+        current = {
+            i.ingredient_id: i
+            for i in RecipeIngredient.objects.filter(recipe=self)
+        }
+        deltas = {pk: -i.amount for pk, i in current.items()}
+        for i in ingredients:
+            deltas[i['id'].pk] = deltas.get(i['id'].pk, 0) + i['amount']
+        new, changed = [], []
+        for i in ingredients:
+            instance = current.pop(i['id'].pk, None)
+            if instance is None:
+                new.append(i)
+            elif instance.amount != i['amount']:
+                instance.amount = i['amount']
+                changed.append(instance)
+        if current:
+            RecipeIngredient.objects.filter(
+                pk__in=[i.pk for i in current.values()]
+            ).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if new:
+            self.add_ingredients(self, new)
+        if not any(deltas.values()):
+            return
+        user_ids = list(ShoppingCart.objects.filter(recipe=self).values_list(
+            'user_id', flat=True
+        ))
+        ShoppingCartIngredient.objects.apply(user_ids, deltas)
+        bump_version(*(f'cart:{user_id}' for user_id in user_ids))
 
     @classmethod
     def create(cls, author, **data):
@@ -136,8 +204,6 @@ class Recipe(models.Model):
                 recipe.save()
                 cls.add_ingredients(recipe, ingredients)
                 recipe.tags.set(tags)
-                recipe.is_favorited = False
-                recipe.is_in_shopping_cart = False
                 return recipe
         except DatabaseError:
             cls.handle_exception()
@@ -146,11 +212,10 @@ class Recipe(models.Model):
         tags, ingredients, data = self.get_tags_ingredients(**data)
         for field, value in data.items():
             setattr(self, field, value)
-        RecipeIngredient.objects.filter(recipe=self).delete()
-        self.add_ingredients(self, ingredients)
-        self.save()
-        self.tags.clear()
-        self.tags.set(tags)
+        with transaction.atomic():
+            self.save()
+            self.set_ingredients(ingredients)
+            self.tags.set(tags)
         return self
 
 
@@ -200,6 +265,8 @@ class Favorite(models.Model):
         verbose_name='рецепт'
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ['user']
         verbose_name = _('избранное')
@@ -211,6 +278,20 @@ class Favorite(models.Model):
             )
         ]
 
+    @staticmethod
+    def recipes_added(user_id, recipe_ids):
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            favorites_count=models.F('favorites_count') + 1
+        )
+        bump_version(f'favorites:{user_id}')
+
+    @staticmethod
+    def recipes_removed(user_id, recipe_ids):
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            favorites_count=models.F('favorites_count') - 1
+        )
+        bump_version(f'favorites:{user_id}')
+
 
 class ShoppingCart(models.Model):
     user = models.ForeignKey(
@@ -225,6 +306,8 @@ class ShoppingCart(models.Model):
         verbose_name='рецепт'
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ['user']
         verbose_name = _('список покупок')
@@ -235,3 +318,69 @@ class ShoppingCart(models.Model):
                 name="user and recipe in shopping cart not unique"
             )
         ]
+
+    @staticmethod
+    def recipes_added(user_id, recipe_ids):
+        ShoppingCartIngredient.objects.add_recipes(user_id, recipe_ids)
+        bump_version(f'cart:{user_id}')
+
+    @staticmethod
+    def recipes_removed(user_id, recipe_ids):
+        ShoppingCartIngredient.objects.remove_recipes(user_id, recipe_ids)
+        bump_version(f'cart:{user_id}')
+
+
+class ShoppingCartIngredient(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя.
+
+    Таблица пересчитывается по разнице при изменении списка покупок и
+    ингредиентов рецептов, поэтому список покупок читается без агрегации.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='ингредиент'
+    )
+    amount = models.IntegerField(
+        verbose_name='количество',
+    )
+
+    objects = ShoppingCartIngredientQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['user']
+        verbose_name = _('ингредиент в списке покупок')
+        verbose_name_plural = _('ингредиенты в списке покупок')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name="user and shopping cart ingredient not unique"
+            )
+        ]
+
+
+class DataVersion(models.Model):
+    """Версия набора данных для ключей кеша, см. recipes.cache.
+
+    Версии хранятся в базе, а не в кеше: кеш может вытеснить ключ, и
+    созданная заново версия совпала бы с уже использованной.
+    """
+    name = models.CharField(
+        verbose_name='набор данных',
+        max_length=100,
+        primary_key=True
+    )
+    value = models.BigIntegerField(
+        verbose_name='версия',
+        default=0
+    )
+
+    class Meta:
+        verbose_name = _('версия данных')
+        verbose_name_plural = _('версии данных')
@@ -1,6 +1,126 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from binascii import Error as DecodeError
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class KeysetPagination(BasePagination):
+    """Навигация по ключу (pub_date, id) без COUNT и OFFSET.
+
+    Курсор хранит дату публикации и id крайнего рецепта страницы, поэтому
+    любая страница выбирается одним запросом по индексу, независимо от ее
+    глубины.
+    """
+    page_size = CustomPagination.page_size
+    page_size_query_param = CustomPagination.page_size_query_param
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            reverse, pub_date, pk = b64decode(
+                encoded.encode('ascii')
+            ).decode('ascii').split('|')
+            pub_date, pk = parse_datetime(pub_date), int(pk)
+        except (DecodeError, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return reverse == '1', (pub_date, pk)
+
+    def encode_cursor(self, reverse, instance):
+        cursor = '|'.join((
+            str(int(reverse)), instance.pub_date.isoformat(), str(instance.pk)
+        ))
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            b64encode(cursor.encode('ascii')).decode('ascii')
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        reverse, position = self.decode_cursor(request)
+        if position is None:
+            queryset = queryset.order_by('-pub_date', '-pk')
+        else:
+            pub_date, pk = position
+            if reverse:
+                queryset = queryset.filter(
+                    Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk)
+                ).order_by('pub_date', 'pk')
+            else:
+                queryset = queryset.filter(
+                    Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+                ).order_by('-pub_date', '-pk')
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(False, self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(True, self.page[0])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class RecipePagination(CustomPagination):
+    """Навигация по номерам страниц или, если передан cursor, по ключу.
+
+    Первая страница в режиме курсора запрашивается с пустым ?cursor=.
+    """
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if KeysetPagination.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination()
+            self.display_page_controls = False
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
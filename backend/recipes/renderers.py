@@ -0,0 +1,37 @@
+from django.http import Http404
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+
+
+class FileRenderer(JSONRenderer):
+    """Рендерер для view, которые сами формируют файл ответа.
+
+    Нужен, чтобы DRF принимал ?format=pdf|txt|csv при согласовании
+    формата; JSONRenderer в renderer_classes должен стоять первым, чтобы
+    остальные запросы и ошибки отдавались в JSON.
+    """
+
+
+class PDFRenderer(FileRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+class PlainTextRenderer(FileRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(FileRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class FormatFallbackNegotiation(DefaultContentNegotiation):
+    """Неизвестный ?format= дает рендерер по умолчанию, а не 404."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except Http404:
+            return renderers[0], renderers[0].media_type
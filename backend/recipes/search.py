@@ -0,0 +1,204 @@
+import logging
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import combinations
+
+from django.db import connection
+
+from .cache import get_version
+from .models import Ingredient
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    return text.casefold().replace('ё', 'е').strip()
+
+
+def deletes(word, depth):
+    """Все варианты слова без не более чем depth символов."""
+    return {
+        ''.join(word[i] for i in range(len(word)) if i not in removed)
+        for count in range(min(depth, len(word)) + 1)
+        for removed in combinations(range(len(word)), count)
+    }
+
+
+def distance(first, second, limit):
+    """Расстояние Левенштейна или limit + 1, если оно больше limit."""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, char in enumerate(first, 1):
+        current = [i]
+        for j, other in enumerate(second, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char != other)
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения по названию.
+
+    Первый раз индекс строится синхронно при первом поиске в процессе,
+    параллельные запросы ждут его на блокировке. Индекс помнит версию
+    'ingredients', с которой он построен, и перестраивается в фоновом
+    потоке, когда сигналы меняют эту версию в общем кеше; до окончания
+    перестройки поиск идет по прежним данным.
+    """
+    ngram_size = 3
+    max_distance = 2
+    prefix_length = 7
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._building = False
+        self._version = None
+        self._data = None
+
+    def _build(self):
+        version = get_version('ingredients')
+        ingredients = sorted(
+            Ingredient.objects.all(),
+            key=lambda i: (normalize(i.name), i.pk)
+        )
+        keys = [normalize(i.name) for i in ingredients]
+        ngrams = defaultdict(list)
+        for position, key in enumerate(keys):
+            grams = {
+                key[start:start + size]
+                for size in range(1, self.ngram_size + 1)
+                for start in range(len(key) - size + 1)
+            }
+            for gram in grams:
+                ngrams[gram].append(position)
+        words = defaultdict(dict)
+        for position, key in enumerate(keys):
+            for order, word in enumerate(WORD_RE.findall(key)):
+                words[word].setdefault(position, order)
+        variants = defaultdict(list)
+        for word in words:
+            prefix = word[:self.prefix_length]
+            for variant in deletes(prefix, self.max_distance):
+                variants[variant].append(word)
+        self._data = (
+            ingredients, keys, dict(ngrams), dict(words), dict(variants)
+        )
+        self._version = version
+
+    def _rebuild(self):
+        try:
+            self._build()
+        except Exception:
+            logger.exception('Не удалось построить индекс ингредиентов')
+        finally:
+            self._building = False
+            connection.close()
+
+    def _get_data(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._build()
+            return self._data
+        if self._version != get_version('ingredients'):
+            with self._lock:
+                if not self._building:
+                    self._building = True
+                    threading.Thread(
+                        target=self._rebuild, daemon=True,
+                        name='ingredient-index'
+                    ).start()
+        return self._data
+
+    def search(self, query):
+        """Возвращает ингредиенты, в названии которых есть query.
+
+        Сначала идут названия, начинающиеся с query, затем остальные
+        совпадения; внутри каждой группы порядок алфавитный.
+        """
+        ingredients, keys, ngrams, _, _ = self._get_data()
+        query = normalize(query)
+        if not query:
+            return list(ingredients)
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + '\U0010ffff', start)
+        if len(query) <= self.ngram_size:
+            candidates = ngrams.get(query, [])
+        else:
+            candidates = min(
+                (
+                    ngrams.get(query[i:i + self.ngram_size], [])
+                    for i in range(len(query) - self.ngram_size + 1)
+                ),
+                key=len
+            )
+        return ingredients[start:end] + [
+            ingredients[position] for position in candidates
+            if not start <= position < end and query in keys[position]
+        ]
+
+    def allowed_distance(self, word):
+        if len(word) < 3:
+            return 0
+        if len(word) < 5:
+            return 1
+        return self.max_distance
+
+    def fuzzy_search(self, query, limit=10):
+        """Возвращает limit ингредиентов, ближайших к query с учетом опечаток.
+
+        Каждое слово запроса сопоставляется со словами названий по
+        расстоянию Левенштейна. Кандидаты находятся по индексу удалений
+        символов (SymSpell), поэтому время поиска не зависит от размера
+        каталога. Ингредиент подходит, если для каждого слова запроса в его
+        названии есть похожее слово; выдача упорядочена по сумме расстояний,
+        затем по позиции совпавшего слова в названии и по алфавиту.
+        """
+        ingredients, _, _, words, variants = self._get_data()
+        scores = None
+        for word in WORD_RE.findall(normalize(query)):
+            limit_distance = self.allowed_distance(word)
+            matches = {}
+            candidates = {
+                candidate
+                for variant in deletes(
+                    word[:self.prefix_length], limit_distance
+                )
+                for candidate in variants.get(variant, ())
+            }
+            for candidate in candidates:
+                word_distance = distance(word, candidate, limit_distance)
+                if word_distance > limit_distance:
+                    continue
+                for position, order in words[candidate].items():
+                    rank = (word_distance, order)
+                    if position not in matches or rank < matches[position]:
+                        matches[position] = rank
+            if scores is None:
+                scores = matches
+                continue
+            scores = {
+                position: (score[0] + matches[position][0], score[1])
+                for position, score in scores.items()
+                if position in matches
+            }
+        if not scores:
+            return []
+        best = sorted(
+            scores, key=lambda position: (scores[position], position)
+        )[:limit]
+        return [ingredients[position] for position in best]
+
+
+ingredient_index = IngredientIndex()
@@ -1,7 +1,13 @@
-from drf_extra_fields.fields import Base64ImageField
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.db.models import Manager, prefetch_related_objects
 from rest_framework import serializers, validators
 
 from users.serializers import CustomUserSerializer
+from .cache import get_versions
+from .fields import (BulkPrimaryKeyRelatedField, ImageVariantField,
+                     UploadableImageField, resolve_pks)
 from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
                      ShoppingCart, Tag)
 
@@ -34,10 +40,11 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
 
 
 class IngredientAmountSerializer(serializers.ModelSerializer):
-    """Cериализатор для добавления ингредиентов при создании рецепта."""
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    """Cериализатор для добавления ингредиентов при создании рецепта.
+
+    Ингредиенты по id загружаются разом в RecipeCreateSerializer.
+    """
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -45,13 +52,60 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount', )
 
 
+def get_recipe_flags(request, recipe_ids):
+    """Флаги избранного и корзины пользователя, запомненные в запросе.
+
+    Возвращает словарь {id рецепта: (is_favorited, is_in_shopping_cart)},
+    в базу запрашиваются только id, которых еще нет в словаре.
+    """
+    if not hasattr(request, 'recipe_flags'):
+        request.recipe_flags = {}
+    missing = [pk for pk in recipe_ids if pk not in request.recipe_flags]
+    if missing:
+        request.recipe_flags.update(
+            Recipe.objects.user_flags(request.user, missing)
+        )
+    return request.recipe_flags
+
+
+def get_fragment_key(request, recipe):
+    """Ключ фрагмента: рецепт, его updated_at, версии тегов и ингредиентов.
+
+    Схема и хост входят в ключ, потому что ссылка на изображение абсолютная.
+    """
+    if not hasattr(request, 'fragment_versions'):
+        request.fragment_versions = '{}:{}:{}://{}'.format(
+            *get_versions('tags', 'ingredients'), request.scheme,
+            request.get_host()
+        )
+    return 'recipe:{}:{}:{}'.format(
+        recipe.pk, recipe.updated_at.timestamp(), request.fragment_versions
+    )
+
+
+class RecipeDisplayListSerializer(serializers.ListSerializer):
+    """Собирает рецепты из кеша фрагментов, см. RecipeDisplaySerializer."""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        return self.child.represent(recipes)
+
+
 class RecipeDisplaySerializer(serializers.ModelSerializer):
-    """Cериализатор для отображения одного или нескольких рецептов."""
+    """Cериализатор для отображения одного или нескольких рецептов.
+
+    Общая для всех пользователей часть ответа хранится в кеше fragments по
+    рецепту и его версии. Фрагменты страницы читаются одним get_many,
+    сериализуются только промахи, а поверх проставляются флаги текущего
+    пользователя: is_favorited, is_in_shopping_cart и is_subscribed автора.
+    Флаги берутся из id избранного, корзины и подписок, загруженных один
+    раз на запрос.
+    """
     tags = TagSerializer(read_only=True, many=True)
     author = CustomUserSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(read_only=True, many=True)
-    is_favorited = serializers.BooleanField()
-    is_in_shopping_cart = serializers.BooleanField()
+    is_favorited = serializers.SerializerMethodField()
+    is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -59,16 +113,65 @@ class RecipeDisplaySerializer(serializers.ModelSerializer):
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
             'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time',
         )
+        list_serializer_class = RecipeDisplayListSerializer
+
+    def get_flags(self, obj):
+        return get_recipe_flags(self.context.get('request'), [obj.pk])[obj.pk]
+
+    def get_is_favorited(self, obj):
+        return self.get_flags(obj)[0]
+
+    def get_is_in_shopping_cart(self, obj):
+        return self.get_flags(obj)[1]
+
+    def represent(self, recipes):
+        request = self.context.get('request')
+        get_recipe_flags(request, [recipe.pk for recipe in recipes])
+        keys = {recipe.pk: get_fragment_key(request, recipe)
+                for recipe in recipes}
+        fragments = caches['fragments'].get_many(keys.values())
+        misses = [recipe for recipe in recipes
+                  if keys[recipe.pk] not in fragments]
+        if misses:
+            prefetch_related_objects(
+                misses, *Recipe.objects.prefetch_lookups()
+            )
+            built = {
+                keys[recipe.pk]: super(
+                    RecipeDisplaySerializer, self
+                ).to_representation(recipe)
+                for recipe in misses
+            }
+            caches['fragments'].set_many(built)
+            fragments.update(built)
+        followed_ids = (
+            CustomUserSerializer.get_followed_ids(request)
+            if request.user.is_authenticated else set()
+        )
+        result = []
+        for recipe in recipes:
+            data = OrderedDict(fragments[keys[recipe.pk]])
+            data['is_favorited'], data['is_in_shopping_cart'] = (
+                self.get_flags(recipe)
+            )
+            data['author'] = OrderedDict(
+                data['author'],
+                is_subscribed=recipe.author_id in followed_ids
+            )
+            result.append(data)
+        return result
+
+    def to_representation(self, instance):
+        if self.parent is not None:
+            return super().to_representation(instance)
+        return self.represent([instance])[0]
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Cериализатор для создания и редактирования рецепта."""
     ingredients = IngredientAmountSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
-    )
-    image = Base64ImageField()
+    tags = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all())
+    image = UploadableImageField()
 
     class Meta:
         model = Recipe
@@ -77,17 +180,26 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
     def validate_ingredients(self, ingredients):
         if self.context.get('request').method in ['POST', 'PUT', 'PATCH']:
-            ingredient_id_list = []
-            for i in ingredients:
-                if i['id'] in ingredient_id_list:
-                    raise validators.ValidationError(
-                        {'ingredients': 'Ингредиенты должны быть уникальными'}
-                    )
-                if i['amount'] < 1:
-                    raise validators.ValidationError(
-                        {'amount': 'Значение должно быть больше ноля'}
-                    )
-                ingredient_id_list.append(i['id'])
+            ingredient_ids = [i['id'] for i in ingredients]
+            if len(set(ingredient_ids)) != len(ingredient_ids):
+                raise validators.ValidationError(
+                    {'ingredients': 'Ингредиенты должны быть уникальными'}
+                )
+            if any(i['amount'] < 1 for i in ingredients):
+                raise validators.ValidationError(
+                    {'amount': 'Значение должно быть больше ноля'}
+                )
+        found, missing = resolve_pks(
+            Ingredient.objects.all(), [i['id'] for i in ingredients]
+        )
+        if missing:
+            raise validators.ValidationError(
+                {'ingredients': 'Ингредиенты с id {} не существуют'.format(
+                    ', '.join(str(pk) for pk in missing)
+                )}
+            )
+        for i, ingredient in zip(ingredients, found):
+            i['id'] = ingredient
         return ingredients
 
     def validate_name(self, name):
@@ -101,8 +213,13 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         return name
 
     def create(self, validated_data):
-        user = self.context.get('request').user
-        return Recipe.create(user, **validated_data)
+        request = self.context.get('request')
+        recipe = Recipe.create(request.user, **validated_data)
+        # Нового рецепта еще нет ни в избранном, ни в списке покупок.
+        if not hasattr(request, 'recipe_flags'):
+            request.recipe_flags = {}
+        request.recipe_flags[recipe.pk] = (False, False)
+        return recipe
 
     def update(self, instance, validated_data):
         return instance.update(**validated_data)
@@ -116,13 +233,26 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
 class RecipePreviewSerializer(serializers.ModelSerializer):
     """Cериализатор для превью рецепта."""
+    image = ImageVariantField('thumb')
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
 class FavoriteShoppingSerializer(serializers.ModelSerializer):
-    """Cериализатор родитель для Favorite и ShoppingCart."""
+    """Cериализатор родитель для Favorite и ShoppingCart.
+
+    Запись добавляется одним запросом INSERT ... ON CONFLICT DO NOTHING,
+    после сохранения created показывает, была ли она добавлена сейчас.
+    """
+    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+
+    def create(self, validated_data):
+        user, recipe = validated_data['user'], validated_data['recipe']
+        self.created = bool(self.Meta.model.objects.add(user, [recipe.pk]))
+        return self.Meta.model(user=user, recipe=recipe)
+
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
@@ -130,6 +260,7 @@ class FavoriteShoppingSerializer(serializers.ModelSerializer):
 
     class Meta:
         fields = ('user', 'recipe',)
+        validators = []
 
 
 class FavoriteSerializer(FavoriteShoppingSerializer):
@@ -137,23 +268,31 @@ class FavoriteSerializer(FavoriteShoppingSerializer):
 
     class Meta(FavoriteShoppingSerializer.Meta):
         model = Favorite
-        validators = [
-            validators.UniqueTogetherValidator(
-                queryset=Favorite.objects.all(),
-                fields=['user', 'recipe'],
-                message='Вы уже добавили этот рецепт в избранное'
-            )
-        ]
 
 
 class ShoppingCartSerializer(FavoriteShoppingSerializer):
     """Cериализатор для добавления рецепта в список покупок."""
     class Meta(FavoriteShoppingSerializer.Meta):
         model = ShoppingCart
-        validators = [
-            validators.UniqueTogetherValidator(
-                queryset=ShoppingCart.objects.all(),
-                fields=['user', 'recipe'],
-                message='Вы уже добавили этот рецепт в список покупок'
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    """Cериализатор списка рецептов для пакетного добавления и удаления."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+    def validate_recipes(self, recipe_ids):
+        recipes = Recipe.objects.filter(pk__in=recipe_ids).only(
+            'id', 'name', 'image', 'cooking_time'
+        )
+        found = {recipe.pk: recipe for recipe in recipes}
+        missing = [pk for pk in dict.fromkeys(recipe_ids) if pk not in found]
+        if missing:
+            raise validators.ValidationError(
+                'Рецепты не найдены: '
+                + ', '.join(str(pk) for pk in missing)
             )
-        ]
+        return [found[pk] for pk in dict.fromkeys(recipe_ids)]
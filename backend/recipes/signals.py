@@ -0,0 +1,85 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import bump_version
+from .images import schedule_variants
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, Tag)
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    bump_version('ingredients')
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(**kwargs):
+    bump_version('tags')
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def make_image_variants(instance, raw, **kwargs):
+    if instance.image and not raw and instance.image_changed:
+        schedule_variants(instance.image.name)
+    instance.saved_image_name = instance.image.name
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(instance, created, raw, **kwargs):
+    """Профиль автора входит в ответ рецепта, поэтому меняет его ETag."""
+    if created or raw or not instance.profile_changed:
+        return
+    Recipe.objects.filter(author=instance).touch()
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=F('recipes_count') - 1
+    )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def recipe_added(sender, instance, created, **kwargs):
+    if created:
+        sender.recipes_added(instance.user_id, [instance.recipe_id])
+
+
+# pre_delete, потому что при удалении рецепта его ингредиенты
+# удаляются каскадом раньше, чем отправляется post_delete.
+@receiver(pre_delete, sender=Favorite)
+@receiver(pre_delete, sender=ShoppingCart)
+def recipe_removed(sender, instance, **kwargs):
+    sender.recipes_removed(instance.user_id, [instance.recipe_id])
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Ingredient)
+@receiver(post_delete, sender=User)
+def invalidate_recipes(**kwargs):
+    """Меняет версию кеша ответов по рецептам для анонимных пользователей."""
+    bump_version('recipes')
+
+
+@receiver(post_save, sender=User)
+def invalidate_recipes_on_profile_change(instance, created, raw, **kwargs):
+    """Меняет версию, если изменился профиль автора, показанный в рецептах."""
+    if created or raw or not instance.profile_changed:
+        return
+    if Recipe.objects.filter(author=instance).exists():
+        bump_version('recipes')
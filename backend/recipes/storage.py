@@ -0,0 +1,81 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def content_hash(content):
+    """SHA-256 содержимого файла, читаемого частями."""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def write_atomic(path, chunks, permissions_mode=None):
+    """Записывает chunks в файл path, заменяя существующий.
+
+    Данные пишутся во временный файл рядом и переименовываются, поэтому
+    читатели не видят файл частично записанным, а параллельные записи
+    одного имени не порождают копий с суффиксами.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+        if permissions_mode is not None:
+            os.chmod(temporary, permissions_mode)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """Хранилище, именующее файлы по хешу содержимого.
+
+    Файл сохраняется как <каталог>/<2 символа хеша>/<хеш>.<расширение>,
+    одинаковые изображения хранятся один раз, а имя никогда не указывает
+    на другое содержимое, поэтому ссылки можно кешировать навсегда.
+    Один файл может принадлежать нескольким записям - удалять его вместе
+    с записью нельзя.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # Занятое имя указывает на то же содержимое, суффикс не нужен.
+        return name
+
+    def _save(self, name, content):
+        write_atomic(
+            self.path(name), content.chunks(), self.file_permissions_mode
+        )
+        return name
+
+    @staticmethod
+    def hashed_name(name, content):
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        digest = content_hash(content)
+        return posixpath.join(directory, digest[:2], digest + extension)
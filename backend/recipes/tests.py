@@ -0,0 +1,318 @@
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, ShoppingCartIngredient, Tag)
+from .search import ingredient_index
+
+User = get_user_model()
+
+# Кеши в памяти процесса вместо файлового кеша проекта.
+TEST_CACHES = {
+    alias: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'test-{alias}',
+    }
+    for alias in ('default', 'fragments', 'versions')
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeListQueriesTest(TestCase):
+    """Число запросов /api/recipes/ не зависит от размера страницы.
+
+    Кеши очищаются перед каждым запросом, чтобы считать запросы
+    холодного ответа, когда все фрагменты рецептов строятся заново.
+    """
+    anonymous_queries = 7
+    authenticated_queries = 9
+    detail_queries = 9
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Читателев', password='pass'
+        )
+        authors = [
+            User.objects.create_user(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Автор', last_name=str(i), password='pass'
+            )
+            for i in range(3)
+        ]
+        tags = [
+            Tag.objects.create(
+                name=f'тег {i}', color=f'#00000{i}', slug=f'tag{i}'
+            )
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {i}', measurement_unit='г'
+            )
+            for i in range(10)
+        ]
+        for i in range(12):
+            recipe = Recipe.objects.create(
+                author=authors[i % len(authors)], name=f'рецепт {i}',
+                image='recipes/test.jpg', text='текст', cooking_time=10
+            )
+            recipe.tags.set(tags[:i % len(tags) + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=1
+                )
+                for ingredient in ingredients[:1 + i % len(ingredients)]
+            )
+        first, second = Recipe.objects.all()[:2]
+        Favorite.objects.create(user=cls.user, recipe=first)
+        ShoppingCart.objects.create(user=cls.user, recipe=second)
+        cls.user.follower.create(following=first.author)
+
+    def setUp(self):
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, client, url):
+        caches['default'].clear()
+        caches['fragments'].clear()
+        caches['versions'].clear()
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assert_list_queries(self, client, queries):
+        for limit in (1, 6, 12):
+            with self.subTest(limit=limit), self.assertNumQueries(queries):
+                self.get(client, f'/api/recipes/?limit={limit}')
+
+    def test_anonymous_list(self):
+        self.assert_list_queries(self.anonymous, self.anonymous_queries)
+
+    def test_authenticated_list(self):
+        self.assert_list_queries(self.client, self.authenticated_queries)
+
+    def test_ingredient_count_does_not_matter(self):
+        recipe = Recipe.objects.first()
+        url = f'/api/recipes/{recipe.pk}/'
+        with self.assertNumQueries(self.detail_queries):
+            self.get(self.client, url)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=2)
+            for ingredient in Ingredient.objects.exclude(
+                pk__in=recipe.ingredients.values('ingredient_id')
+            )
+        )
+        with self.assertNumQueries(self.detail_queries):
+            self.get(self.client, url)
+
+    def test_cursor_page_etag(self):
+        url = '/api/recipes/?cursor=&limit=3'
+        with CaptureQueriesContext(connection) as context:
+            response = self.get(self.client, url)
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in context.captured_queries
+        ))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_flags(self):
+        response = self.get(self.client, '/api/recipes/?limit=2')
+        first, second = response.data['results']
+        self.assertTrue(first['is_favorited'])
+        self.assertFalse(first['is_in_shopping_cart'])
+        self.assertFalse(second['is_favorited'])
+        self.assertTrue(second['is_in_shopping_cart'])
+        self.assertTrue(first['author']['is_subscribed'])
+        response = self.get(self.anonymous, '/api/recipes/?limit=2')
+        for recipe in response.data['results']:
+            self.assertFalse(recipe['is_favorited'])
+            self.assertFalse(recipe['author']['is_subscribed'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShoppingCartTotalsTest(TestCase):
+    """Итоги списков покупок, обновляемые по разнице, совпадают с пересчетом.
+
+    После каждого шага таблица сравнивается с результатом rebuild().
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'buyer{i}@example.com', username=f'buyer{i}',
+                first_name='Покупатель', last_name=str(i), password='pass'
+            )
+            for i in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {i}', measurement_unit='г'
+            )
+            for i in range(4)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.users[0], name=f'рецепт {i}',
+                image='recipes/test.jpg', text='текст', cooking_time=10
+            )
+            for i in range(2)
+        ]
+        for recipe, amounts in zip(cls.recipes, ((10, 20, 0), (5, 0, 7))):
+            for ingredient, amount in zip(cls.ingredients, amounts):
+                if amount:
+                    RecipeIngredient.objects.create(
+                        recipe=recipe, ingredient=ingredient, amount=amount
+                    )
+
+    def assert_matches_rebuild(self):
+        rows = ShoppingCartIngredient.objects.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        )
+        current = set(rows)
+        ShoppingCartIngredient.objects.rebuild()
+        self.assertEqual(current, set(rows))
+        return current
+
+    def test_totals(self):
+        first, second = self.recipes
+        reader, other = self.users
+        ShoppingCart.objects.add(reader, [first.pk, second.pk])
+        ShoppingCart.objects.add(other, [second.pk])
+        self.assertIn(
+            (reader.pk, self.ingredients[0].pk, 15),
+            self.assert_matches_rebuild()
+        )
+
+        first.set_ingredients([
+            {'id': self.ingredients[0], 'amount': 1},
+            {'id': self.ingredients[3], 'amount': 4},
+        ])
+        self.assert_matches_rebuild()
+
+        ShoppingCart.objects.remove(reader, [second.pk])
+        self.assert_matches_rebuild()
+
+        first.delete()
+        self.assertFalse(ShoppingCartIngredient.objects.filter(
+            user=reader
+        ).exists())
+        self.assert_matches_rebuild()
+
+        RecipeIngredient.objects.filter(recipe=second).update(amount=9)
+        RecipeIngredient.objects.create(
+            recipe=second, ingredient=self.ingredients[1], amount=3
+        )
+        admin.site._registry[Recipe].save_related(
+            None, SimpleNamespace(instance=second, save_m2m=lambda: None),
+            [], True
+        )
+        self.assertEqual(
+            self.assert_matches_rebuild(),
+            {(other.pk, self.ingredients[0].pk, 9),
+             (other.pk, self.ingredients[1].pk, 3),
+             (other.pk, self.ingredients[2].pk, 9)}
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IngredientSearchTest(TestCase):
+    """Поиск ингредиентов одинаков в новом и уже работающем процессе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Масло сливочное', 'Молоко', 'Сливки', 'Пармезан'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        ingredient_index._data = ingredient_index._version = None
+
+    def search(self, name):
+        response = APIClient().get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_first_search_uses_index(self):
+        self.assertEqual(self.search('мол'), ['Молоко'])
+        self.assertEqual(self.search('сли'), ['Сливки', 'Масло сливочное'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ConcurrentAddTest(TransactionTestCase):
+    """Повторные добавления из параллельных запросов не создают дублей.
+
+    Ровно один запрос получает 201, остальные - 200, строка одна, а
+    счетчик избранного увеличен один раз.
+    """
+    threads = 5
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Общая память SQLite сообщает о блокировке таблицы сразу,
+            # не дожидаясь конца чужой транзакции.
+            self.skipTest('нужна база в файле или PostgreSQL')
+        patcher = mock.patch('recipes.signals.schedule_variants')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Читателев', password='pass'
+        )
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Авторов', password='pass'
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='рецепт', image='recipes/test.jpg',
+            text='текст', cooking_time=10
+        )
+
+    def post_concurrently(self, url):
+        barrier = threading.Barrier(self.threads)
+        statuses = []
+
+        def post():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                barrier.wait()
+                statuses.append(client.post(url).status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=post) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(sorted(statuses), [200] * (self.threads - 1) + [201])
+
+    def test_favorite(self):
+        self.post_concurrently(f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assertEqual(Favorite.objects.filter(user=self.user).count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_shopping_cart(self):
+        self.post_concurrently(
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/'
+        )
+        self.assertEqual(
+            ShoppingCart.objects.filter(user=self.user).count(), 1
+        )
+
+    def test_subscribe(self):
+        self.post_concurrently(f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(self.user.follower.count(), 1)
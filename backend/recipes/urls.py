@@ -1,12 +1,12 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import RecipeViewSet, shopping_list
+from .views import RecipeViewSet, ShoppingListView
 
 router = DefaultRouter()
 router.register('', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
-    path('download_shopping_cart/', shopping_list),
+    path('download_shopping_cart/', ShoppingListView.as_view()),
     path('', include(router.urls)),
 ]
@@ -1,68 +1,135 @@
+import csv
 import io
+import json
+import os
 
-from django.db.models import Exists, OuterRef, Sum
-from django.http import FileResponse
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from reportlab.pdfbase import pdfmetrics, ttfonts
 from reportlab.pdfgen import canvas
 from rest_framework import status, viewsets
-from rest_framework.decorators import action, api_view, permission_classes
-from rest_framework.generics import get_object_or_404
+from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from .cache import get_versions
 from .filters import IngredientFilter, RecipeFilter
-from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingCart, Tag)
-from .pagination import CustomPagination
+from .mixins import (AnonymousCacheMixin, CachedListMixin,
+                     ConditionalRetrieveListMixin)
+from .models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                     ShoppingCartIngredient, Tag)
+from .pagination import RecipePagination
 from .permissions import CreateOrAuthorOrReadOnly
+from .renderers import (CSVRenderer, FormatFallbackNegotiation, PDFRenderer,
+                        PlainTextRenderer)
 from .serializers import (FavoriteSerializer, IngredientSerializer,
-                          RecipeCreateSerializer, RecipeDisplaySerializer,
+                          RecipeBatchSerializer, RecipeCreateSerializer,
+                          RecipeDisplaySerializer, RecipePreviewSerializer,
                           ShoppingCartSerializer, TagSerializer)
 
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+pdfmetrics.registerFont(
+    ttfonts.TTFont(
+        'Bitter',
+        os.path.join(settings.BASE_DIR, 'data', 'Bitter-VariableFont.ttf')
+    )
+)
+
+
+class TagViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     permission_classes = [AllowAny]
     serializer_class = TagSerializer
+    cache_version_name = 'tags'
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     permission_classes = [AllowAny]
     serializer_class = IngredientSerializer
+    cache_version_name = 'ingredients'
     filter_backends = [IngredientFilter, ]
-    search_fields = ['name']
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AnonymousCacheMixin, ConditionalRetrieveListMixin,
+                    viewsets.ModelViewSet):
+    """Рецепты.
+
+    Создание и редактирование принимают JSON с картинкой в base64 или
+    multipart/form-data с файлом в поле image; в форме теги передаются
+    повторяющимся полем tags, ингредиенты - полями ingredients[0]id и
+    ingredients[0]amount.
+    """
+    parser_classes = [JSONParser, MultiPartParser]
     permission_classes = [CreateOrAuthorOrReadOnly]
     filter_backends = [DjangoFilterBackend, ]
     filterset_class = RecipeFilter
-    pagination_class = CustomPagination
+    pagination_class = RecipePagination
+    etag_version_names = ('tags', 'ingredients')
+    etag_user_version_names = ('favorites:{}', 'cart:{}', 'follows:{}')
+    anonymous_cache_version_name = 'recipes'
 
     def get_queryset(self):
-        user = self.request.user
-        return Recipe.objects.annotated(user).prefetched(user)
+        # Теги, ингредиенты и авторов догружает RecipeDisplaySerializer
+        # только для рецептов, которых нет в кеше фрагментов.
+        return Recipe.objects.all()
 
     def get_serializer_class(self):
-        if self.request.method in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve']:
             return RecipeDisplaySerializer
         return RecipeCreateSerializer
 
     @staticmethod
     def post_method(request, recipe_id, serializers):
-        data = {'user': request.user.id, 'recipe': recipe_id}
+        data = {'recipe': recipe_id}
         serializer = serializers(data=data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(
+            serializer.data,
+            status=(
+                status.HTTP_201_CREATED if serializer.created
+                else status.HTTP_200_OK
+            )
+        )
 
     @staticmethod
     def delete_method(request, recipe_id, model):
-        user = request.user
-        instance = get_object_or_404(model, user=user, recipe_id=recipe_id)
-        instance.delete()
+        try:
+            removed = model.objects.remove(request.user, [int(recipe_id)])
+        except ValueError:
+            removed = []
+        if not removed:
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @staticmethod
+    def batch_post_method(request, model):
+        serializer = RecipeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.validated_data['recipes']
+        model.objects.add(request.user, [recipe.pk for recipe in recipes])
+        return Response(
+            RecipePreviewSerializer(
+                recipes, many=True, context={'request': request}
+            ).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @staticmethod
+    def batch_delete_method(request, model):
+        serializer = RecipeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        model.objects.remove(
+            request.user,
+            [recipe.pk for recipe in serializer.validated_data['recipes']]
+        )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -97,14 +164,39 @@ class RecipeViewSet(viewsets.ModelViewSet):
             request, pk, ShoppingCart
         )
 
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='favorite',
+        url_name='favorite-batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def favorite_batch(self, request):
+        return self.batch_post_method(request, Favorite)
+
+    @favorite_batch.mapping.delete
+    def delete_favorite_batch(self, request):
+        return self.batch_delete_method(request, Favorite)
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='shopping_cart',
+        url_name='shopping-cart-batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_batch(self, request):
+        return self.batch_post_method(request, ShoppingCart)
+
+    @shopping_cart_batch.mapping.delete
+    def delete_shopping_cart_batch(self, request):
+        return self.batch_delete_method(request, ShoppingCart)
+
 
 def create_pdf(ingredients):
     x, y = 50, 770
     buffer = io.BytesIO()
     pdf = canvas.Canvas(buffer)
-    pdfmetrics.registerFont(
-        ttfonts.TTFont('Bitter', 'data/Bitter-VariableFont.ttf')
-    )
     pdf.setTitle('Список_покупок')
     pdf.setFont('Bitter', 16)
     pdf.drawString(x, y, 'Cписок покупок')
@@ -120,28 +212,110 @@ def create_pdf(ingredients):
         y -= 20
     pdf.showPage()
     pdf.save()
-    buffer.seek(0)
-    return FileResponse(
-        buffer,
-        as_attachment=True,
-        filename='Shopping_list.pdf'
-    )
+    return buffer.getvalue()
 
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def shopping_list(request):
-    ingredients = RecipeIngredient.objects.annotate(
-        is_in_shopping_cart=Exists(
-            ShoppingCart.objects.filter(
-                user=request.user, recipe=OuterRef('recipe__pk')
-            )
+class Echo:
+    """Псевдо-файл для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def stream_txt(ingredients):
+    for i in ingredients.iterator():
+        yield (
+            f'{i["ingredient__name"]} - {i["amount"]}'
+            f' {i["ingredient__measurement_unit"]}\n'
+        )
+
+
+def stream_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for i in ingredients.iterator():
+        yield writer.writerow((
+            i['ingredient__name'],
+            i['amount'],
+            i['ingredient__measurement_unit']
+        ))
+
+
+def stream_json(ingredients):
+    yield '['
+    for number, i in enumerate(ingredients.iterator()):
+        yield (',' if number else '') + json.dumps(
+            {
+                'name': i['ingredient__name'],
+                'amount': i['amount'],
+                'measurement_unit': i['ingredient__measurement_unit'],
+            },
+            ensure_ascii=False
         )
-    ).filter(
-        is_in_shopping_cart=True
+    yield ']'
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (stream_txt, 'text/plain; charset=utf-8'),
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'json': (stream_json, 'application/json'),
+}
+
+
+def get_shopping_list(user):
+    return ShoppingCartIngredient.objects.filter(
+        user=user
     ).values(
-        'ingredient__name', 'ingredient__measurement_unit',
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
     ).order_by(
         'ingredient__name'
-    ).annotate(amount=Sum('amount'))
-    return create_pdf(ingredients)
+    )
+
+
+def get_shopping_list_key(user):
+    """Ключ кеша списка покупок, меняющийся при любом изменении его данных.
+
+    Версия cart:<id> меняется при изменении списка покупок пользователя и
+    ингредиентов рецептов в нем, ingredients - названий и единиц измерения.
+    """
+    return 'shopping_list:{}:{}:{}'.format(
+        user.pk, *get_versions(f'cart:{user.pk}', 'ingredients')
+    )
+
+
+class ShoppingListView(APIView):
+    """Список покупок в PDF или, с ?format=txt|csv|json, потоком строк."""
+    renderer_classes = [
+        JSONRenderer, PDFRenderer, PlainTextRenderer, CSVRenderer
+    ]
+    content_negotiation_class = FormatFallbackNegotiation
+    permission_classes = [IsAuthenticated]
+
+    def handle_exception(self, exc):
+        # Ошибки отдаются в JSON и при ?format=pdf|txt|csv.
+        self.request.accepted_renderer = JSONRenderer()
+        self.request.accepted_media_type = JSONRenderer.media_type
+        return super().handle_exception(exc)
+
+    def get(self, request):
+        export_format = request.query_params.get('format')
+        if export_format in SHOPPING_LIST_FORMATS:
+            stream, content_type = SHOPPING_LIST_FORMATS[export_format]
+            response = StreamingHttpResponse(
+                stream(get_shopping_list(request.user)),
+                content_type=content_type
+            )
+            response['Content-Disposition'] = (
+                f'attachment; filename="Shopping_list.{export_format}"'
+            )
+            return response
+        key = get_shopping_list_key(request.user)
+        content = cache.get(key)
+        if content is None:
+            content = create_pdf(get_shopping_list(request.user))
+            cache.set(key, content, SHOPPING_LIST_CACHE_TIMEOUT)
+        return FileResponse(
+            io.BytesIO(content),
+            as_attachment=True,
+            filename='Shopping_list.pdf'
+        )
@@ -1,8 +1,23 @@
 from django.contrib.auth.models import BaseUserManager
-from django.db.models import Count, Exists, OuterRef, QuerySet
+from django.db.models import Exists, OuterRef, Prefetch, QuerySet
+from django.db.models.expressions import RawSQL
 
 from . import models
 
+LATEST_RECIPES_SQL = """
+    SELECT ranked.id FROM (
+        SELECT recipe.id, ROW_NUMBER() OVER (
+            PARTITION BY recipe.author_id
+            ORDER BY recipe.pub_date DESC, recipe.id DESC
+        ) AS row_number
+        FROM {recipe} AS recipe
+        INNER JOIN {follow} AS follow
+            ON follow.following_id = recipe.author_id
+        WHERE follow.follower_id = %s
+    ) AS ranked
+    WHERE ranked.row_number <= %s
+"""
+
 
 class CustomUserManager(BaseUserManager):
 
@@ -40,8 +55,6 @@ class SubscriptionQuerySet(QuerySet):
 
     def annotated(self, user):
         return self.annotate(
-            recipes_count=Count('recipes')
-        ).annotate(
             is_subscribed=Exists(
                 models.Follow.objects.filter(
                     follower=user,
@@ -50,5 +63,24 @@ class SubscriptionQuerySet(QuerySet):
             )
         )
 
-    def prefetched(self):
-        return self.prefetch_related('recipes').all()
+    def prefetched(self, user, recipes_limit=None):
+        """Загружает превью рецептов авторов, на которых подписан user.
+
+        Если задан recipes_limit, лишние рецепты отсекаются в базе оконной
+        функцией ROW_NUMBER() по каждому автору, а не после загрузки.
+        """
+        recipe_model = self.model._meta.get_field('recipes').related_model
+        recipes = recipe_model.objects.only(
+            'id', 'name', 'image', 'cooking_time', 'author'
+        )
+        if recipes_limit == 0:
+            recipes = recipes.none()
+        elif recipes_limit is not None:
+            recipes = recipes.filter(pk__in=RawSQL(
+                LATEST_RECIPES_SQL.format(
+                    recipe=recipe_model._meta.db_table,
+                    follow=models.Follow._meta.db_table
+                ),
+                (user.pk, recipes_limit)
+            ))
+        return self.prefetch_related(Prefetch('recipes', queryset=recipes))
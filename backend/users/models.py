@@ -1,11 +1,13 @@
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.db import models
+from django.db.models import DEFERRED
 from django.utils.translation import gettext as _
 
+from recipes.db import CounterFieldsMixin
 from users.managers import CustomUserManager, SubscriptionQuerySet
 
 
-class User(AbstractBaseUser, PermissionsMixin):
+class User(CounterFieldsMixin, AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(
         verbose_name='адрес электронной почты',
         max_length=254,
@@ -28,6 +30,11 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='количество рецептов',
+        default=0,
+        editable=False,
+    )
 
     USERNAME_FIELD = 'email'
     EMAIL_FIELD = 'email'
@@ -35,6 +42,9 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     objects = CustomUserManager()
     users = SubscriptionQuerySet.as_manager()
+    counter_fields = ('recipes_count', )
+    # Поля профиля, которые показываются в ответах с рецептами.
+    profile_fields = ('email', 'username', 'first_name', 'last_name')
 
     class Meta:
         ordering = ['id', ]
@@ -44,6 +54,31 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if all(
+            loaded.get(name, DEFERRED) is not DEFERRED
+            for name in cls.profile_fields
+        ):
+            instance.saved_profile = instance.get_profile()
+        return instance
+
+    def get_profile(self):
+        return tuple(getattr(self, name) for name in self.profile_fields)
+
+    def save(self, *args, **kwargs):
+        """Сохраняет и отмечает в profile_changed, изменился ли профиль.
+
+        Флаг читают обработчики post_save: смена пароля или last_login не
+        меняет ответы с рецептами автора.
+        """
+        profile = self.get_profile()
+        self.profile_changed = profile != getattr(self, 'saved_profile', None)
+        super().save(*args, **kwargs)
+        self.saved_profile = profile
+
 
 class Follow(models.Model):
     follower = models.ForeignKey(
@@ -1,8 +1,11 @@
 from django.contrib.auth import get_user_model
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
-from rest_framework.validators import UniqueTogetherValidator, ValidationError
+from rest_framework.validators import ValidationError
 
+from recipes.cache import bump_version
+from recipes.db import insert_or_ignore
+from recipes.fields import ImageVariantField
 from recipes.models import Recipe
 from .models import Follow
 
@@ -19,10 +22,23 @@ class CustomUserSerializer(UserSerializer):
             'last_name', 'is_subscribed'
         )
 
+    @staticmethod
+    def get_followed_ids(request):
+        """Id авторов, на которых подписан пользователь, один раз за запрос."""
+        if not hasattr(request, 'followed_ids'):
+            request.followed_ids = set(
+                request.user.follower.order_by().values_list(
+                    'following_id', flat=True
+                )
+            )
+        return request.followed_ids
+
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated and
-                user.follower.filter(following=obj).exists())
+        if hasattr(obj, 'is_subscribed'):
+            return bool(obj.is_subscribed)
+        request = self.context.get('request')
+        return (request.user.is_authenticated and
+                obj.id in self.get_followed_ids(request))
 
 
 class CustomUserCreateSerializer(UserCreateSerializer):
@@ -39,6 +55,8 @@ class CustomUserCreateSerializer(UserCreateSerializer):
 
 
 class FollowRecipeSerializer(serializers.ModelSerializer):
+    image = ImageVariantField('thumb')
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
@@ -55,11 +73,16 @@ class FollowDisplaySerializer(serializers.ModelSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
+        """Рецепты автора, уже ограниченные recipes_limit из контекста.
+
+        Список из FollowDisplayView отсечен при загрузке; для одного автора
+        без prefetch ограничение попадает в запрос как LIMIT.
+        """
         recipes = obj.recipes.all()
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+        recipes_limit = self.context.get('recipes_limit')
+        prefetched = getattr(obj, '_prefetched_objects_cache', {})
+        if recipes_limit is not None and 'recipes' not in prefetched:
+            recipes = recipes[:recipes_limit]
         return FollowRecipeSerializer(
             recipes,
             many=True,
@@ -67,17 +90,31 @@ class FollowDisplaySerializer(serializers.ModelSerializer):
 
 
 class FollowCreateSerializer(serializers.ModelSerializer):
+    """Подписка одним запросом INSERT ... ON CONFLICT DO NOTHING.
+
+    После сохранения created показывает, была ли подписка добавлена сейчас.
+    """
+    follower = serializers.HiddenField(
+        default=serializers.CurrentUserDefault()
+    )
 
     class Meta:
         model = Follow
         fields = ('follower', 'following')
-        validators = [
-            UniqueTogetherValidator(
-                queryset=Follow.objects.all(),
-                fields=('follower', 'following'),
-                message='Вы уже подписаны на этого автора'
-            ),
-        ]
+        validators = []
+
+    def create(self, validated_data):
+        follower = validated_data['follower']
+        following = validated_data['following']
+        self.created = bool(insert_or_ignore(
+            Follow,
+            [{'follower_id': follower.pk, 'following_id': following.pk}],
+            'following_id'
+        ))
+        if self.created:
+            bump_version(f'follows:{follower.pk}')
+        following.is_subscribed = True
+        return Follow(follower=follower, following=following)
 
     def validate_following(self, following):
         request = self.context['request']
@@ -87,8 +124,6 @@ class FollowCreateSerializer(serializers.ModelSerializer):
         return following
 
     def to_representation(self, instance):
-        request = self.context.get('request')
-        context = {'request': request}
         return FollowDisplaySerializer(
-            instance.following, context=context
+            instance.following, context=self.context
         ).data
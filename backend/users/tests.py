@@ -0,0 +1,92 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class SubscriptionsRecipesLimitTest(TestCase):
+    """recipes_limit оставляет у каждого автора N самых новых рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Читателев', password='pass'
+        )
+        other = User.objects.create_user(
+            email='other@example.com', username='other',
+            first_name='Другой', last_name='Читатель', password='pass'
+        )
+        authors = [
+            User.objects.create_user(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Автор', last_name=str(i), password='pass'
+            )
+            for i in range(3)
+        ]
+        now = timezone.now()
+        cls.recipes = {}
+        for author in authors:
+            recipe_ids = []
+            for i in range(4):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'рецепт {i}',
+                    image='recipes/test.jpg', text='текст', cooking_time=10
+                )
+                # Даты публикации идут не в порядке id.
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    pub_date=now - timedelta(days=(i * 3) % 4)
+                )
+                recipe_ids.append(recipe.pk)
+            cls.recipes[author.pk] = Recipe.objects.filter(
+                pk__in=recipe_ids
+            ).order_by('-pub_date', '-pk').values_list('pk', flat=True)
+        for author in authors[:2]:
+            cls.user.follower.create(following=author)
+        for author in authors:
+            other.follower.create(following=author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_recipes(self, recipes_limit):
+        response = self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': recipes_limit}
+        )
+        self.assertEqual(response.status_code, 200)
+        return {
+            author['id']: [recipe['id'] for recipe in author['recipes']]
+            for author in response.data['results']
+        }
+
+    def expected(self, recipes_limit=None):
+        return {
+            author_id: list(recipe_ids[:recipes_limit])
+            for author_id, recipe_ids in self.recipes.items()
+            if self.user.follower.filter(following_id=author_id).exists()
+        }
+
+    def test_limit(self):
+        for recipes_limit in (1, 3, 10):
+            with self.subTest(recipes_limit=recipes_limit):
+                self.assertEqual(
+                    self.get_recipes(recipes_limit),
+                    self.expected(recipes_limit)
+                )
+
+    def test_zero_limit(self):
+        self.assertEqual(self.get_recipes(0), self.expected(0))
+
+    def test_invalid_limit_is_ignored(self):
+        for recipes_limit in ('abc', -1):
+            with self.subTest(recipes_limit=recipes_limit):
+                self.assertEqual(
+                    self.get_recipes(recipes_limit), self.expected()
+                )
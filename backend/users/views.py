@@ -4,6 +4,7 @@ from rest_framework import generics, status, views
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from recipes.cache import bump_version
 from recipes.pagination import CustomPagination
 from .models import Follow
 from .serializers import FollowCreateSerializer, FollowDisplaySerializer
@@ -15,14 +16,30 @@ class CustomUserViewSet(UserViewSet):
     pagination_class = CustomPagination
 
 
+def get_recipes_limit(request):
+    """recipes_limit из запроса; нечисловые и отрицательные игнорируются."""
+    try:
+        recipes_limit = int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        return None
+    return recipes_limit if recipes_limit >= 0 else None
+
+
 class FollowDisplayView(generics.ListAPIView):
     serializer_class = FollowDisplaySerializer
     permission_classes = [IsAuthenticated]
     pagination_class = CustomPagination
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['recipes_limit'] = get_recipes_limit(self.request)
+        return context
+
     def get_queryset(self):
         user = self.request.user
-        return User.users.filtered(user).annotated(user).prefetched()
+        return User.users.filtered(user).annotated(user).prefetched(
+            user, get_recipes_limit(self.request)
+        )
 
 
 class FollowCreateView(views.APIView):
@@ -31,16 +48,24 @@ class FollowCreateView(views.APIView):
 
     def post(self, request, user_id):
         data = {
-            'follower': request.user.id,
             'following': user_id
         }
         serializer = FollowCreateSerializer(
             data=data,
-            context={'request': request}
+            context={
+                'request': request,
+                'recipes_limit': get_recipes_limit(request),
+            }
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(
+            serializer.data,
+            status=(
+                status.HTTP_201_CREATED if serializer.created
+                else status.HTTP_200_OK
+            )
+        )
 
     def delete(self, request, user_id):
         try:
@@ -48,6 +73,7 @@ class FollowCreateView(views.APIView):
                 follower=request.user,
                 following=user_id
             ).delete()
+            bump_version(f'follows:{request.user.pk}')
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Follow.DoesNotExist:
             return Response(